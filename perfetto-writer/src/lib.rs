@@ -1,8 +1,7 @@
 use anyhow::Result;
-use dashmap::DashMap;
 use protobuf::{Message, MessageField};
-use smol_str::SmolStr;
 use std::{
+    borrow::Borrow,
     collections::HashMap,
     io::Write,
     sync::atomic::{AtomicU64, Ordering::Relaxed},
@@ -63,34 +62,35 @@ impl InternID {
 
 #[derive(Default, Debug)]
 pub(crate) struct Intern<T: Eq + std::hash::Hash> {
-    next_id: AtomicU64,
-    items: DashMap<T, u64>,
+    next_id: u64,
+    items: HashMap<T, u64>,
 }
 
-impl<T: Clone + std::hash::Hash + Eq> Intern<T> {
-    pub(crate) fn intern(&self, value: T) -> InternID {
-        match self.items.entry(value) {
-            dashmap::Entry::Occupied(o) => InternID::Existing(*o.get()),
-            dashmap::Entry::Vacant(v) => {
-                let id = self.next_id();
-                v.insert(id);
-                InternID::New(id)
-            }
+impl<T: std::hash::Hash + Eq> Intern<T> {
+    // Only reached through `&mut Context`, so no locking is needed. Hits look
+    // up the borrowed value; the owned key is built only on a miss.
+    pub(crate) fn intern<Q>(&mut self, value: &Q) -> InternID
+    where
+        Q: ?Sized + std::hash::Hash + Eq + ToOwned<Owned = T>,
+        T: Borrow<Q>,
+    {
+        if let Some(id) = self.items.get(value) {
+            return InternID::Existing(*id);
         }
-    }
-
-    fn next_id(&self) -> u64 {
-        self.next_id.fetch_add(1, Relaxed) + 1
+        self.next_id += 1;
+        self.items.insert(value.to_owned(), self.next_id);
+        InternID::New(self.next_id)
     }
 }
 
 #[derive(Default)]
 pub struct Context {
-    event_names: Intern<SmolStr>,
-    debug_annotation_names: Intern<SmolStr>,
-    debug_annotation_str_values: Intern<SmolStr>,
-    categories: Intern<SmolStr>,
-    source_locations: Intern<(SmolStr, u32)>,
+    event_names: Intern<String>,
+    debug_annotation_names: Intern<String>,
+    debug_annotation_str_values: Intern<String>,
+    categories: Intern<String>,
+    source_files: Intern<String>,
+    source_locations: Intern<(u64, u32)>,
     buffer: Trace,
     seq: u32,
     next_id: AtomicU64,
@@ -134,11 +134,23 @@ impl Context {
     }
 
     pub fn write_to<W: Write>(&mut self, w: &mut W) -> Result<()> {
-        let trace = std::mem::take(&mut self.buffer);
-        trace.write_to_writer(w)?;
+        self.take_trace().write_to_writer(w)?;
         w.flush()?;
         Ok(())
     }
+
+    /// Drains the buffered trace into a single exactly-sized Vec.
+    ///
+    /// Like `write_to`, this leaves the buffer empty; a second call only
+    /// returns packets emitted since the first.
+    pub fn take_bytes(&mut self) -> Result<Vec<u8>> {
+        Ok(self.take_trace().write_to_bytes()?)
+    }
+
+    fn take_trace(&mut self) -> Trace {
+        std::mem::take(&mut self.buffer)
+    }
+
     pub fn event<'a>(&'a mut self) -> EventBuilder<'a> {
         EventBuilder::new(self)
     }
@@ -152,9 +164,10 @@ impl Context {
         TrackBuilder::new(self).uuid(id)
     }
 
-    fn source_location<'a>(&'a mut self, file: impl Into<SmolStr>, line: u32) -> u64 {
-        let file = file.into();
-        let id = self.source_locations.intern((file.clone(), line));
+    fn source_location<'a>(&'a mut self, file: impl AsRef<str>, line: u32) -> u64 {
+        let file = file.as_ref();
+        let file_id = self.source_files.intern(file).as_u64();
+        let id = self.source_locations.intern(&(file_id, line));
         match id {
             InternID::New(id) => {
                 let mut tp = TracePacket::new();
@@ -174,9 +187,9 @@ impl Context {
         }
     }
 
-    fn intern_event_name(&mut self, name: impl Into<SmolStr>) -> InternID {
-        let name = name.into();
-        let id = self.event_names.intern(name.clone());
+    fn intern_event_name(&mut self, name: impl AsRef<str>) -> InternID {
+        let name = name.as_ref();
+        let id = self.event_names.intern(name);
         if id.new() {
             let mut tp = TracePacket::new();
             let mut itd = InternedData::new();
@@ -191,9 +204,9 @@ impl Context {
         id
     }
 
-    fn intern_debug_annotation_name(&mut self, name: impl Into<SmolStr>) -> InternID {
-        let name = name.into();
-        let id = self.debug_annotation_names.intern(name.clone());
+    fn intern_debug_annotation_name(&mut self, name: impl AsRef<str>) -> InternID {
+        let name = name.as_ref();
+        let id = self.debug_annotation_names.intern(name);
         if id.new() {
             let mut tp = TracePacket::new();
             let mut itd = InternedData::new();
@@ -208,9 +221,9 @@ impl Context {
         id
     }
 
-    fn intern_debug_annotation_str_value(&mut self, value: impl Into<SmolStr>) -> InternID {
-        let value = value.into();
-        let id = self.debug_annotation_str_values.intern(value.clone());
+    fn intern_debug_annotation_str_value(&mut self, value: impl AsRef<str>) -> InternID {
+        let value = value.as_ref();
+        let id = self.debug_annotation_str_values.intern(value);
         if id.new() {
             let mut tp = TracePacket::new();
             let mut itd = InternedData::new();
@@ -225,9 +238,9 @@ impl Context {
         id
     }
 
-    fn intern_category(&mut self, category: impl Into<SmolStr>) -> InternID {
-        let category = category.into();
-        let id = self.categories.intern(category.clone());
+    fn intern_category(&mut self, category: impl AsRef<str>) -> InternID {
+        let category = category.as_ref();
+        let id = self.categories.intern(category);
         if id.new() {
             let mut tp = TracePacket::new();
             let mut itd = InternedData::new();
@@ -396,22 +409,22 @@ impl<'a> EventBuilder<'a> {
         self.event.set_type(Type::TYPE_COUNTER);
     }
 
-    pub fn category(&mut self, category: impl Into<SmolStr>) {
+    pub fn category(&mut self, category: impl AsRef<str>) {
         let id = self.ctx.intern_category(category);
         self.event.category_iids.push(id.into());
     }
 
-    pub fn source_location(&mut self, file: impl Into<SmolStr>, line: u32) {
+    pub fn source_location(&mut self, file: impl AsRef<str>, line: u32) {
         let loc = self.ctx.source_location(file, line);
         self.event.set_source_location_iid(loc);
     }
 
-    pub fn name(&mut self, name: impl Into<SmolStr>) {
+    pub fn name(&mut self, name: impl AsRef<str>) {
         let id = self.ctx.intern_event_name(name);
         self.event.set_name_iid(id.into());
     }
 
-    pub fn debug_str(&mut self, name: impl Into<SmolStr>, value: impl Into<SmolStr>) {
+    pub fn debug_str(&mut self, name: impl AsRef<str>, value: impl AsRef<str>) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let vid = self.ctx.intern_debug_annotation_str_value(value);
         let mut da = DebugAnnotation::new();
@@ -420,7 +433,7 @@ impl<'a> EventBuilder<'a> {
         self.event.debug_annotations.push(da);
     }
 
-    pub fn debug_bool(&mut self, name: impl Into<SmolStr>, value: bool) {
+    pub fn debug_bool(&mut self, name: impl AsRef<str>, value: bool) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let mut da = DebugAnnotation::new();
         da.set_name_iid(id.into());
@@ -428,7 +441,7 @@ impl<'a> EventBuilder<'a> {
         self.event.debug_annotations.push(da);
     }
 
-    pub fn debug_int(&mut self, name: impl Into<SmolStr>, value: i64) {
+    pub fn debug_int(&mut self, name: impl AsRef<str>, value: i64) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let mut da = DebugAnnotation::new();
         da.set_name_iid(id.into());
@@ -436,7 +449,7 @@ impl<'a> EventBuilder<'a> {
         self.event.debug_annotations.push(da);
     }
 
-    pub fn debug_uint(&mut self, name: impl Into<SmolStr>, value: u64) {
+    pub fn debug_uint(&mut self, name: impl AsRef<str>, value: u64) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let mut da = DebugAnnotation::new();
         da.set_name_iid(id.into());
@@ -444,7 +457,7 @@ impl<'a> EventBuilder<'a> {
         self.event.debug_annotations.push(da);
     }
 
-    pub fn debug_double(&mut self, name: impl Into<SmolStr>, value: f64) {
+    pub fn debug_double(&mut self, name: impl AsRef<str>, value: f64) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let mut da = DebugAnnotation::new();
         da.set_name_iid(id.into());
@@ -452,7 +465,7 @@ impl<'a> EventBuilder<'a> {
         self.event.debug_annotations.push(da);
     }
 
-    pub fn debug_pointer(&mut self, name: impl Into<SmolStr>, value: u64) {
+    pub fn debug_pointer(&mut self, name: impl AsRef<str>, value: u64) {
         let id = self.ctx.intern_debug_annotation_name(name);
         let mut da = DebugAnnotation::new();
         da.set_name_iid(id.into());
@@ -520,17 +533,17 @@ impl<'a> EventBuilder<'a> {
         self
     }
 
-    pub fn with_category(mut self, category: impl Into<SmolStr>) -> Self {
+    pub fn with_category(mut self, category: impl AsRef<str>) -> Self {
         self.category(category);
         self
     }
 
-    pub fn with_source_location(mut self, file: impl Into<SmolStr>, line: u32) -> Self {
+    pub fn with_source_location(mut self, file: impl AsRef<str>, line: u32) -> Self {
         self.source_location(file, line);
         self
     }
 
-    pub fn with_name(mut self, name: impl Into<SmolStr>) -> Self {
+    pub fn with_name(mut self, name: impl AsRef<str>) -> Self {
         self.name(name);
         self
     }
@@ -540,32 +553,32 @@ impl<'a> EventBuilder<'a> {
         self
     }
 
-    pub fn with_debug_str(mut self, name: impl Into<SmolStr>, value: impl Into<SmolStr>) -> Self {
+    pub fn with_debug_str(mut self, name: impl AsRef<str>, value: impl AsRef<str>) -> Self {
         self.debug_str(name, value);
         self
     }
 
-    pub fn with_debug_bool(mut self, name: impl Into<SmolStr>, value: bool) -> Self {
+    pub fn with_debug_bool(mut self, name: impl AsRef<str>, value: bool) -> Self {
         self.debug_bool(name, value);
         self
     }
 
-    pub fn with_debug_int(mut self, name: impl Into<SmolStr>, value: i64) -> Self {
+    pub fn with_debug_int(mut self, name: impl AsRef<str>, value: i64) -> Self {
         self.debug_int(name, value);
         self
     }
 
-    pub fn with_debug_uint(mut self, name: impl Into<SmolStr>, value: u64) -> Self {
+    pub fn with_debug_uint(mut self, name: impl AsRef<str>, value: u64) -> Self {
         self.debug_uint(name, value);
         self
     }
 
-    pub fn with_debug_double(mut self, name: impl Into<SmolStr>, value: f64) -> Self {
+    pub fn with_debug_double(mut self, name: impl AsRef<str>, value: f64) -> Self {
         self.debug_double(name, value);
         self
     }
 
-    pub fn with_debug_pointer(mut self, name: impl Into<SmolStr>, value: u64) -> Self {
+    pub fn with_debug_pointer(mut self, name: impl AsRef<str>, value: u64) -> Self {
         self.debug_pointer(name, value);
         self
     }
@@ -700,7 +713,7 @@ mod tests {
 
     #[test]
     fn same_id() -> Result<()> {
-        let i = Intern::default();
+        let mut i: Intern<String> = Intern::default();
         let id = i.intern("a");
         assert_eq!(id.as_u64(), i.intern("a").as_u64());
         Ok(())
@@ -744,6 +757,25 @@ mod tests {
         Ok(())
     }
 
+    #[test]
+    fn take_bytes_matches_write_to() -> Result<()> {
+        let mut buf = Vec::new();
+        let mut a = Context::new_with_seq(1);
+        let mut b = Context::new_with_seq(1);
+        for ctx in [&mut a, &mut b] {
+            ctx.event()
+                .with_instant()
+                .with_name("test")
+                .with_debug_str("key", "value")
+                .with_track_uuid(1)
+                .build();
+        }
+        a.write_to(&mut buf)?;
+        assert_eq!(buf, b.take_bytes()?);
+        assert!(Trace::parse_from_bytes(&b.take_bytes()?)?.packet.is_empty());
+        Ok(())
+    }
+
     #[test]
     fn event_round_trip() -> Result<()> {
         let mut buf = Vec::new();
@@ -860,6 +892,17 @@ mod tests {
         Ok(())
     }
 
+    // current_thread() must not be cached in a thread-local or static: a forked
+    // child inherits the forking thread's TLS and would report the parent's tid.
+    // This at least catches a cache that collapses into a process-wide value.
+    #[test]
+    fn current_thread_differs_across_threads() {
+        let main_tid = current_thread();
+        let other_tid = std::thread::spawn(current_thread).join().unwrap();
+        assert_ne!(main_tid, other_tid);
+        assert_eq!(main_tid, current_thread());
+    }
+
     #[test]
     fn track_current_process_and_thread() -> Result<()> {
         let mut buf = Vec::new();
@@ -1,4 +1,5 @@
 use std::fs::File;
+use std::io::Write as _;
 use tokio::time::{sleep, Duration};
 use tracing::{info, info_span, instrument};
 use tracing_perfetto_writer::PerfettoLayer;
@@ -97,7 +98,6 @@ async fn main() {
 
     // Write the trace data to a file
     let mut file = File::create("trace_async.pftrace").expect("Failed to create trace file");
-    use std::io::Write as _;
     file.write_all(&trace_data)
         .expect("Failed to write trace data");
 
@@ -1,4 +1,5 @@
 use std::fs::File;
+use std::io::Write as _;
 use std::thread;
 use std::time::Duration;
 use tracing::{info, info_span};
@@ -61,7 +62,6 @@ fn main() {
 
     // Write the trace data to a file
     let mut file = File::create("trace_basic.pftrace").expect("Failed to create trace file");
-    use std::io::Write as _;
     file.write_all(&trace_data)
         .expect("Failed to write trace data");
 
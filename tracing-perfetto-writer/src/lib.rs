@@ -1,4 +1,5 @@
 use perfetto_writer::{Context, EventBuilder};
+use smol_str::format_smolstr;
 use std::sync::{Arc, Mutex};
 use tracing::field::Visit;
 use tracing::{Subscriber, span};
@@ -37,8 +38,29 @@ impl From<u64> for TrackId {
 struct EventBuilderVisitor<'a>(EventBuilder<'a>);
 
 impl<'a> Visit for EventBuilderVisitor<'a> {
+    fn record_f64(&mut self, field: &tracing::field::Field, value: f64) {
+        self.0.debug_double(field.name(), value);
+    }
+
+    fn record_i64(&mut self, field: &tracing::field::Field, value: i64) {
+        self.0.debug_int(field.name(), value);
+    }
+
+    fn record_u64(&mut self, field: &tracing::field::Field, value: u64) {
+        self.0.debug_uint(field.name(), value);
+    }
+
+    fn record_bool(&mut self, field: &tracing::field::Field, value: bool) {
+        self.0.debug_bool(field.name(), value);
+    }
+
+    fn record_str(&mut self, field: &tracing::field::Field, value: &str) {
+        self.0.debug_str(field.name(), value);
+    }
+
     fn record_debug(&mut self, field: &tracing::field::Field, value: &dyn std::fmt::Debug) {
-        self.0.debug_str(field.name(), &format!("{:?}", value));
+        self.0
+            .debug_str(field.name(), format_smolstr!("{:?}", value));
     }
 }
 
@@ -67,9 +89,7 @@ impl PerfettoLayer {
 
     /// Flushes the underlying Perfetto context to a Vec
     pub fn flush(&self) -> Result<Vec<u8>, Box<dyn std::error::Error>> {
-        let mut buf = Vec::new();
-        self.context.lock().unwrap().write_to(&mut buf)?;
-        Ok(buf)
+        Ok(self.context.lock().unwrap().take_bytes()?)
     }
 }
 
@@ -78,10 +98,10 @@ where
     S: Subscriber + for<'a> LookupSpan<'a>,
 {
     fn on_new_span(&self, attrs: &span::Attributes<'_>, id: &span::Id, ctx: LayerContext<'_, S>) {
-        let mut context = self.context.lock().unwrap();
-        let thread_track: TrackId = context.current_thread_track().into();
-        let slice_id: SliceId = context.next_id().into();
         if let Some(span) = ctx.span(id) {
+            let mut context = self.context.lock().unwrap();
+            let thread_track: TrackId = context.current_thread_track().into();
+            let slice_id: SliceId = context.next_id().into();
             let mut exe = span.extensions_mut();
             exe.insert(thread_track);
             exe.insert(slice_id);
@@ -141,8 +161,8 @@ where
     // }
 
     fn on_close(&self, id: span::Id, ctx: LayerContext<'_, S>) {
-        let mut context = self.context.lock().unwrap();
         if let Some(span) = ctx.span(&id) {
+            let mut context = self.context.lock().unwrap();
             let exe = span.extensions();
             let track = exe.get::<TrackId>().unwrap();
             context
@@ -156,8 +176,10 @@ where
     }
 
     fn on_event(&self, event: &tracing::Event<'_>, ctx: LayerContext<'_, S>) {
-        let mut context = self.context.lock().unwrap();
+        // Events outside of any span are dropped, so don't contend on the
+        // context lock for them.
         if let Some(span) = ctx.event_span(event) {
+            let mut context = self.context.lock().unwrap();
             let exe = span.extensions();
             let track = exe.get::<TrackId>().unwrap();
             let meta = event.metadata();
@@ -184,8 +206,48 @@ where
 #[cfg(test)]
 mod tests {
     use super::*;
+    use perfetto_protos::trace::Trace;
+    use perfetto_protos::track_event::{TrackEvent, track_event::Type};
+    use protobuf::Message;
+    use std::collections::HashMap;
     use tracing_subscriber::prelude::*;
 
+    /// Runs `f` with a PerfettoLayer installed and parses the flushed trace.
+    fn record_trace(f: impl FnOnce()) -> Trace {
+        let layer = PerfettoLayer::new();
+        let subscriber = tracing_subscriber::registry().with(layer.clone());
+        tracing::subscriber::with_default(subscriber, f);
+        let buf = layer.flush().expect("flush failed");
+        Trace::parse_from_bytes(&buf).expect("invalid trace")
+    }
+
+    /// Collects the interned debug annotation names and string values.
+    fn interned_strings(trace: &Trace) -> (HashMap<u64, String>, HashMap<u64, Vec<u8>>) {
+        let mut names = HashMap::new();
+        let mut values = HashMap::new();
+        for packet in &trace.packet {
+            if let Some(interned) = packet.interned_data.as_ref() {
+                for n in &interned.debug_annotation_names {
+                    names.insert(n.iid(), n.name().to_string());
+                }
+                for v in &interned.debug_annotation_string_values {
+                    values.insert(v.iid(), v.str().to_vec());
+                }
+            }
+        }
+        (names, values)
+    }
+
+    fn instant_events(trace: &Trace) -> Vec<&TrackEvent> {
+        trace
+            .packet
+            .iter()
+            .filter(|p| p.has_track_event())
+            .map(|p| p.track_event())
+            .filter(|e| e.type_() == Type::TYPE_INSTANT)
+            .collect()
+    }
+
     #[test]
     fn test_layer_creation() {
         let layer = PerfettoLayer::new();
@@ -206,4 +268,78 @@ mod tests {
             tracing::info!("test event");
         });
     }
+
+    #[test]
+    fn typed_fields_become_typed_annotations() {
+        let trace = record_trace(|| {
+            let span = tracing::info_span!("test_span");
+            let _enter = span.enter();
+            tracing::info!(
+                count = 3u64,
+                delta = -1i64,
+                ok = true,
+                ratio = 0.5,
+                name = "x"
+            );
+        });
+        let (names, values) = interned_strings(&trace);
+
+        let events = instant_events(&trace);
+        assert_eq!(events.len(), 1);
+        let annotations: HashMap<&str, _> = events[0]
+            .debug_annotations
+            .iter()
+            .map(|da| (names[&da.name_iid()].as_str(), da))
+            .collect();
+
+        assert_eq!(annotations["count"].uint_value(), 3);
+        assert_eq!(annotations["delta"].int_value(), -1);
+        assert_eq!(annotations["ok"].bool_value(), true);
+        assert_eq!(annotations["ratio"].double_value(), 0.5);
+        let name = annotations["name"];
+        assert!(name.has_string_value_iid());
+        assert_eq!(values[&name.string_value_iid()], b"x");
+    }
+
+    #[test]
+    fn events_outside_spans_are_dropped() {
+        let trace = record_trace(|| {
+            tracing::info!("outside");
+            let span = tracing::info_span!("test_span");
+            let _enter = span.enter();
+            tracing::info!("inside");
+        });
+        let (names, values) = interned_strings(&trace);
+
+        let events = instant_events(&trace);
+        assert_eq!(events.len(), 1);
+        let message = events[0]
+            .debug_annotations
+            .iter()
+            .find(|da| names[&da.name_iid()] == "message")
+            .expect("missing message annotation");
+        assert_eq!(values[&message.string_value_iid()], b"inside");
+    }
+
+    #[test]
+    fn span_less_events_skip_the_context_lock() {
+        let layer = PerfettoLayer::new();
+        let subscriber = tracing_subscriber::registry().with(layer.clone());
+
+        // Hold the context lock while another thread emits a span-less event;
+        // if on_event still took the lock, the event would block.
+        let guard = layer.context.lock().unwrap();
+        let (tx, rx) = std::sync::mpsc::channel();
+        let handle = std::thread::spawn(move || {
+            tracing::subscriber::with_default(subscriber, || tracing::info!("outside"));
+            tx.send(()).unwrap();
+        });
+        let returned = rx.recv_timeout(std::time::Duration::from_secs(5));
+        drop(guard);
+        handle.join().unwrap();
+        assert!(
+            returned.is_ok(),
+            "span-less event waited on the context lock"
+        );
+    }
 }